@@ -1,18 +1,30 @@
 import sys
+import click
 from flask import (
     Flask, render_template, request,
-    redirect, url_for, flash
+    redirect, url_for, flash,
+    abort, send_file, Response
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, literal, text
 from flask_login import (
     LoginManager, UserMixin,
     login_user, login_required,
     logout_user, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-from flask import jsonify
+from datetime import datetime, date, timedelta
+from flask import jsonify, has_request_context
 import os
+import json
+import threading
+import time
+import asyncio
+import re
+from email.message import EmailMessage
+from documents import DOCUMENT_KINDS, render_document, render_documents, build_zip, document_filename, slugify
+from typeahead import PrefixIndex
+from mailer import Mailer, is_permanent
 import csv
 import locale
 locale.setlocale(locale.LC_ALL, '')
@@ -29,8 +41,24 @@ def get_countries():
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_secret')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite3'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Durée (en jours) après la fin d'une session avant archivage de ses demandes
+app.config['ARCHIVE_RETENTION_DAYS'] = int(os.getenv('ARCHIVE_RETENTION_DAYS', 730))
+# Courriels sortants (accusés de réception et relances), envoyés par `flask send-mails`
+app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 25))
+app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', '0') == '1'
+app.config['MAIL_SENDER'] = os.getenv('MAIL_SENDER', 'noreply@ideca-afrique.org')
+app.config['MAIL_POOL_SIZE'] = int(os.getenv('MAIL_POOL_SIZE', 2))
+app.config['MAIL_RATE'] = float(os.getenv('MAIL_RATE', 5))  # messages par seconde
+app.config['MAIL_BATCH_SIZE'] = int(os.getenv('MAIL_BATCH_SIZE', 100))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+app.config['MAIL_TIMEOUT'] = int(os.getenv('MAIL_TIMEOUT', 30))  # secondes par échange SMTP
+# Délai (en secondes) entre deux lectures du journal par les index d'autocomplétion
+app.config['TYPEAHEAD_REFRESH_INTERVAL'] = float(os.getenv('TYPEAHEAD_REFRESH_INTERVAL', 1))
 
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
@@ -78,11 +106,8 @@ class Seminaire(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
 
 
-class Demande(db.Model):
-    __tablename__ = 'demandes'
-
-    id = db.Column(db.Integer, primary_key=True)
-
+class DemandeColumns:
+    """Colonnes communes à la table courante et à la table d'archive."""
     type = db.Column(db.String(100), nullable=False)
     reference = db.Column(db.String(100), nullable=False)
     theme = db.Column(db.String(200), nullable=False)
@@ -112,11 +137,322 @@ class Demande(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+
+class Demande(DemandeColumns, db.Model):
+    __tablename__ = 'demandes'
+
+    id = db.Column(db.Integer, primary_key=True)
+
     __table_args__ = (
         db.UniqueConstraint('type', 'reference', 'theme', name='unique_type_ref_theme'),
+        # Un id archivé ne doit jamais être réattribué (courriels, journal et archive y font référence)
+        {'sqlite_autoincrement': True},
     )
 
 
+class DemandeArchive(DemandeColumns, db.Model):
+    """Demandes des sessions clôturées, sorties de la table courante par `flask archive`."""
+    __tablename__ = 'demandes_archive'
+
+    archive_id  = db.Column(db.Integer, primary_key=True)
+    id          = db.Column(db.Integer, nullable=False, index=True)  # id d'origine dans `demandes`
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_demandes_archive_date_fin', 'date_fin'),
+    )
+
+
+class Changement(db.Model):
+    """Journal append-only des modifications (flux /changes + piste d'audit)."""
+    __tablename__ = 'changements'
+    __table_args__ = {'sqlite_autoincrement': True}  # seq jamais réutilisé
+
+    seq        = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id     = db.Column(db.Integer, nullable=False)
+    operation  = db.Column(db.String(10), nullable=False)  # 'create' / 'update' / 'delete' / 'archive'
+    payload    = db.Column(db.Text, nullable=True)
+    username   = db.Column(db.String(150), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class Courriel(db.Model):
+    """File d'attente des courriels sortants."""
+    __tablename__ = 'courriels'
+
+    id              = db.Column(db.Integer, primary_key=True)
+    demande_id      = db.Column(db.Integer, nullable=False, index=True)
+    kind            = db.Column(db.String(20), nullable=False)  # 'accuse' / 'relance'
+    recipient       = db.Column(db.String(255), nullable=False)
+    subject         = db.Column(db.String(255), nullable=False)
+    body            = db.Column(db.Text, nullable=False)
+    status          = db.Column(db.String(10), nullable=False, default='pending')  # 'pending' / 'sending' / 'sent' / 'failed'
+    attempts        = db.Column(db.Integer, nullable=False, default=0)
+    last_error      = db.Column(db.String(500), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    created_at      = db.Column(db.DateTime, default=datetime.now)
+    sent_at         = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_courriels_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
+# --------- Serializers ---------
+def demande_to_dict(d):
+    return {
+        "id": d.id,
+        "type": d.type,
+        "reference": d.reference,
+        "theme": d.theme,
+        "nom": d.nom,
+        "prenoms": d.prenoms,
+        "tels": d.tels,
+        "emails": d.emails,
+        "organisme": d.organisme,
+        "pays": d.pays,
+        "contact": d.contact,
+        "lieu": d.lieu_formation,
+        "debut": d.date_debut.strftime('%Y-%m-%d') if d.date_debut else '',
+        "fin": d.date_fin.strftime('%Y-%m-%d') if d.date_fin else '',
+        "duree": d.duree,
+        "dateRecep": d.date_recep_mail.strftime('%Y-%m-%d') if d.date_recep_mail else "",
+        "dateAccuseRecep": d.date_accuse_recep.strftime('%Y-%m-%d') if d.date_accuse_recep else "",
+        "proforma": d.proforma,
+        "fiche": d.fiche_inscription,
+        "attestation": d.attestation
+    }
+
+
+# Tables suivies par le journal des changements et leur sérialisation
+TRACKED_MODELS = {
+    Demande: demande_to_dict,
+    TypeFormation: lambda t: {"id": t.id, "name": t.name},
+    LieuFormation: lambda l: {"id": l.id, "name": l.name},
+    Organisme: lambda o: {"id": o.id, "name": o.name, "country": o.country},
+    Seminaire: lambda s: {"id": s.id, "reference": s.reference, "theme": s.theme,
+                          "type": s.type_formation},
+}
+
+
+def document_contexts(demandes):
+    """Contextes de rendu des documents : la demande complétée par son séminaire et son organisme."""
+    references = {d.reference for d in demandes}
+    names = {d.organisme for d in demandes}
+    seminaires = {s.reference: s for s in Seminaire.query.filter(Seminaire.reference.in_(references))}
+    organismes = {o.name: o for o in Organisme.query.filter(Organisme.name.in_(names))}
+    today = date.today().strftime('%d/%m/%Y')
+
+    contexts = []
+    for d in demandes:
+        context = demande_to_dict(d)
+        seminaire = seminaires.get(d.reference)
+        organisme = organismes.get(d.organisme)
+        context.update(
+            civilite=d.civilite,
+            type=seminaire.type_formation if seminaire else d.type,
+            theme=seminaire.theme if seminaire else d.theme,
+            pays=organisme.country if organisme else d.pays,
+            debut_fr=d.date_debut.strftime('%d/%m/%Y'),
+            fin_fr=d.date_fin.strftime('%d/%m/%Y'),
+            date_emission=today,
+        )
+        contexts.append(context)
+    return contexts
+
+
+# Champs de suivi : clé du formulaire -> (colonne, {valeur canonique: orthographes enregistrées})
+# Les formulaires existants enregistrent aussi 'sent', 'received', 'envoyé'... : les lectures
+# (archivage, relances, mise à jour groupée) acceptent toutes les orthographes, les écritures
+# n'emploient que la valeur canonique.
+STATUS_FIELDS = {
+    'proforma': ('proforma', {
+        'envoyée': ('envoyée', 'envoyé', 'sent'),
+        'non envoyée': ('non envoyée', 'non envoyé', 'not-sent'),
+    }),
+    'fiche': ('fiche_inscription', {
+        'reçue': ('reçue', 'received'),
+        'non reçue': ('non reçue', 'not-received'),
+    }),
+    'attestation': ('attestation', {
+        'envoyée': ('envoyée', 'envoyé', 'sent'),
+        'non envoyée': ('non envoyée', 'non envoyé', 'not-sent'),
+    }),
+}
+
+
+def status_in(field, value):
+    """Condition SQL : le champ de suivi `field` vaut `value`, quelle que soit son orthographe."""
+    column, values = STATUS_FIELDS[field]
+    return getattr(Demande, column).in_(values[value])
+
+
+# Filtres simples acceptés par la mise à jour groupée (cf. apply_demande_filters)
+BULK_FILTER_KEYS = ('type', 'seminaire', 'pays', 'lieu', 'contact', 'debut', 'fin')
+
+
+# --------- Change Log ---------
+def current_username():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.username
+    return None
+
+
+def changement_values(operation, table_name, row, username, now):
+    return {
+        "table_name": table_name,
+        "row_id": row["id"],
+        "operation": operation,
+        "payload": json.dumps(row, ensure_ascii=False) if operation not in ('delete', 'archive') else None,
+        "username": username,
+        "created_at": now,
+    }
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_changes(session, flush_context):
+    entries = []
+    for operation, objects in (('create', session.new),
+                               ('update', session.dirty),
+                               ('delete', session.deleted)):
+        for obj in objects:
+            serialize = TRACKED_MODELS.get(type(obj))
+            if serialize is None:
+                continue
+            if operation == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            row = serialize(obj) if operation != 'delete' else {"id": obj.id}
+            entries.append((operation, obj.__tablename__, row))
+    if not entries:
+        return
+
+    username = current_username()
+    now = datetime.now()
+    session.connection().execute(Changement.__table__.insert(), [
+        changement_values(operation, table_name, row, username, now)
+        for operation, table_name, row in entries
+    ])
+
+
+def log_changes(operation, table_name, rows):
+    """Journalise des lignes modifiées hors ORM (UPDATE ensemblistes), en une seule insertion."""
+    if not rows:
+        return
+    username = current_username()
+    now = datetime.now()
+    db.session.execute(Changement.__table__.insert(), [
+        changement_values(operation, table_name, row, username, now) for row in rows
+    ])
+
+
+def current_cursor():
+    return db.session.query(func.coalesce(func.max(Changement.seq), 0)).scalar()
+
+
+# --------- Typeahead ---------
+# Index d'autocomplétion : nom -> (modèle, textes indexés, portée), sur les dicts de TRACKED_MODELS
+TYPEAHEAD_SOURCES = {
+    'organismes': (Organisme, lambda o: (o['name'],), lambda o: o['country']),
+    'seminaires': (Seminaire, lambda s: (s['reference'], s['theme']), lambda s: s['type']),
+}
+typeahead_indexes = {name: PrefixIndex() for name in TYPEAHEAD_SOURCES}
+typeahead_state = {'cursor': None, 'checked': 0.0, 'warming': False}
+typeahead_lock = threading.Lock()  # protège les index : modifiés en place par refresh, lus par search
+
+
+def refresh_typeahead():
+    """Construit les index au premier appel, puis rejoue le journal des changements depuis le dernier curseur.
+
+    Rejouer le journal plutôt qu'écouter les commits tient à jour les index de chaque worker.
+    Le curseur n'est relu qu'une fois par TYPEAHEAD_REFRESH_INTERVAL, pas à chaque frappe.
+    """
+    interval = app.config['TYPEAHEAD_REFRESH_INTERVAL']
+    if typeahead_state['cursor'] is not None and time.monotonic() - typeahead_state['checked'] < interval:
+        return
+    with typeahead_lock:
+        if typeahead_state['cursor'] is not None and time.monotonic() - typeahead_state['checked'] < interval:
+            return
+        cursor = typeahead_state['cursor']
+        head = current_cursor()
+        if cursor is None:
+            for name, (model, texts, scope) in TYPEAHEAD_SOURCES.items():
+                rows = [TRACKED_MODELS[model](obj) for obj in model.query]
+                typeahead_indexes[name].build((row['id'], texts(row), row, scope(row)) for row in rows)
+        elif head > cursor:
+            sources = {model.__tablename__: name for name, (model, _, _) in TYPEAHEAD_SOURCES.items()}
+            changes = (Changement.query
+                       .filter(Changement.seq > cursor, Changement.seq <= head,
+                               Changement.table_name.in_(sources))
+                       .order_by(Changement.seq))
+            for c in changes:
+                name = sources[c.table_name]
+                _, texts, scope = TYPEAHEAD_SOURCES[name]
+                if c.operation == 'delete':
+                    typeahead_indexes[name].remove(c.row_id)
+                else:
+                    row = json.loads(c.payload)
+                    typeahead_indexes[name].add(row['id'], texts(row), row, scope(row))
+        typeahead_state['cursor'] = head
+        typeahead_state['checked'] = time.monotonic()
+
+
+def build_typeahead():
+    with app.app_context():
+        try:
+            refresh_typeahead()
+        except Exception as e:
+            # La construction sera retentée à la première recherche
+            print(f"Erreur lors de la construction des index d'autocomplétion: {e}")
+
+
+@app.before_request
+def warm_typeahead():
+    """Construit les index en arrière-plan dès la première requête du worker, pas à la première frappe."""
+    if not typeahead_state['warming']:
+        typeahead_state['warming'] = True
+        threading.Thread(target=build_typeahead, daemon=True).start()
+
+
+# --------- Schéma ---------
+def migrate_demandes_autoincrement():
+    """Reconstruit une table `demandes` antérieure à l'archivage avec AUTOINCREMENT ; retourne True si fait.
+
+    Sans AUTOINCREMENT, SQLite réattribue les ids les plus élevés une fois supprimés. La séquence
+    repart au-dessus des ids déjà archivés. pysqlite n'ouvrant pas de transaction avant un DDL,
+    BEGIN IMMEDIATE est émis explicitement : la reconstruction est atomique, et un second processus
+    attend le verrou puis relit un schéma déjà migré.
+    """
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'demandes'")).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            conn.rollback()
+            return False
+        columns = ', '.join(c.name for c in Demande.__table__.columns)
+        conn.execute(text("ALTER TABLE demandes RENAME TO demandes_old"))
+        Demande.__table__.create(conn)
+        conn.execute(text(f"INSERT INTO demandes ({columns}) SELECT {columns} FROM demandes_old"))
+        conn.execute(text("DROP TABLE demandes_old"))
+
+        floor = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM demandes_archive")).scalar()
+        updated = conn.execute(text("UPDATE sqlite_sequence SET seq = MAX(seq, :floor) WHERE name = 'demandes'"),
+                               {"floor": floor}).rowcount
+        if not updated:
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('demandes', :floor)"),
+                         {"floor": floor})
+        conn.commit()
+    return True
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Met à niveau le schéma d'une base existante (à lancer une fois, avant de démarrer les workers)."""
+    # Tables manquantes (journal, archive, file des courriels), puis reconstruction de `demandes`
+    db.create_all()
+    if migrate_demandes_autoincrement():
+        click.echo("Table demandes reconstruite avec AUTOINCREMENT.")
+    click.echo("Schéma à jour.")
 
 # --------- Login Loader ---------
 @login_manager.user_loader
@@ -180,17 +516,6 @@ def demandes():
                 .all()
             )
             return jsonify([t[0] for t in themes])
-        elif data.get('action') == 'get_organismes':
-            country_name = data.get('pays')
-            organismes = (
-                db.session.query(Organisme.name)
-                .filter_by(country=country_name)
-                .distinct()
-                .order_by(Organisme.name)
-                .all()
-            )
-            return jsonify([o[0] for o in organismes])
-
 
         return jsonify({'error': 'Invalid action'}), 400
 
@@ -198,7 +523,9 @@ def demandes():
 
     lieux = LieuFormation.query.order_by(LieuFormation.name).all()
     countries = get_countries()
-    return render_template('demandes.html', types=types, lieux=lieux, countries=countries, demandes=demandes)
+    status_fields = {field: list(values) for field, (_, values) in STATUS_FIELDS.items()}
+    return render_template('demandes.html', types=types, lieux=lieux, countries=countries, demandes=demandes,
+                           cursor=current_cursor(), status_fields=status_fields)
 
 
 
@@ -239,37 +566,35 @@ def operations():
                            seminaires=seminaires,
                            countries=countries,
                            lieux=lieux,
-                           contacts=contacts)
-
+                           contacts=contacts,
+                           cursor=current_cursor())
 
-@app.route('/filtrer-demandes')
-@login_required
-def filtrer_demandes():
-    query = Demande.query
 
-    type_value = request.args.get('type')
+def apply_demande_filters(query, params, model=Demande):
+    """Applique les filtres simples de la page Opérations (valeur 'all' = pas de filtre)."""
+    type_value = params.get('type')
     if type_value and type_value != 'all':
-        query = query.filter(Demande.type == type_value)
+        query = query.filter(model.type == type_value)
 
-    seminaire_value = request.args.get('seminaire')
+    seminaire_value = params.get('seminaire')
     if seminaire_value and seminaire_value != 'all':
-        query = query.filter(Demande.reference == seminaire_value)
+        query = query.filter(model.reference == seminaire_value)
 
-    pays_value = request.args.get('pays')
+    pays_value = params.get('pays')
     if pays_value and pays_value != 'all':
-        query = query.filter(Demande.pays == pays_value)
+        query = query.filter(model.pays == pays_value)
 
-    lieu_value = request.args.get('lieu')
+    lieu_value = params.get('lieu')
     if lieu_value and lieu_value != 'all':
-        query = query.filter(Demande.lieu_formation == lieu_value)
+        query = query.filter(model.lieu_formation == lieu_value)
 
-    contact_value = request.args.get('contact')
+    contact_value = params.get('contact')
     if contact_value and contact_value != 'all':
-        query = query.filter(Demande.contact == contact_value)
+        query = query.filter(model.contact == contact_value)
 
     # Récupération des dates
-    debut = request.args.get('debut')
-    fin = request.args.get('fin')
+    debut = params.get('debut')
+    fin = params.get('fin')
     
     # Logique de filtrage sur la date
     # 1) Si seul debut est fourni → filtre sur égalité sur date_debut
@@ -279,128 +604,148 @@ def filtrer_demandes():
     if debut and not fin:
         try:
             debut_date = datetime.strptime(debut, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_debut == debut_date)
+            query = query.filter(model.date_debut == debut_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'debut': {debut}")
     elif fin and not debut:
         try:
             fin_date = datetime.strptime(fin, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_fin == fin_date)
+            query = query.filter(model.date_fin == fin_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'fin': {fin}")
     elif debut and fin:
         try:
             debut_date = datetime.strptime(debut, "%Y-%m-%d").date()
             fin_date = datetime.strptime(fin, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_debut >= debut_date,
-                                 Demande.date_fin <= fin_date)
+            query = query.filter(model.date_debut >= debut_date,
+                                 model.date_fin <= fin_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'debut' ou 'fin': {debut} / {fin}")
 
-    demandes = query.all()
-    result = []
-    for d in demandes:
-        result.append({
-            "id": d.id,
-            "type": d.type,
-            "reference": d.reference,
-            "theme": d.theme,
-            "nom": d.nom,
-            "prenoms": d.prenoms,
-            "tels": d.tels,
-            "emails": d.emails,
-            "organisme": d.organisme,
-            "pays": d.pays,
-            "contact": d.contact,
-            "lieu": d.lieu_formation,
-            "debut": d.date_debut.strftime('%Y-%m-%d') if d.date_debut else '',
-            "fin": d.date_fin.strftime('%Y-%m-%d') if d.date_fin else '',
-            "duree": d.duree,
-            "dateRecep": d.date_recep_mail.strftime('%Y-%m-%d') if d.date_recep_mail else "",
-            "dateAccuseRecep": d.date_accuse_recep.strftime('%Y-%m-%d') if d.date_accuse_recep else "",
-            "proforma": d.proforma,
-            "fiche": d.fiche_inscription,
-            "attestation": d.attestation
-        })
-    return jsonify(result)
-
+    return query
 
 
-
-@app.route('/filtrer-demandes-avances')
+@app.route('/filtrer-demandes')
 @login_required
-def filtrer_demandes_avances():
-    query = Demande.query
-
-    types = request.args.getlist('types')
-    seminaires = request.args.getlist('seminaires')
-    debut = request.args.get('debut')
-    fin = request.args.get('fin')
+def filtrer_demandes():
+    query = apply_demande_filters(Demande.query, request.args)
 
-    print(f"[DEBUG] Types: {types}", file=sys.stderr)
-    print(f"[DEBUG] Séminaires: {seminaires}", file=sys.stderr)
-    print(f"[DEBUG] Dates: {debut} → {fin}", file=sys.stderr)
+    demandes = query.all()
+    if reaches_archive(request.args.get('debut'), request.args.get('fin')):
+        demandes += apply_demande_filters(DemandeArchive.query, request.args, DemandeArchive).all()
+    result = [demande_to_dict(d) for d in demandes]
+    return jsonify(result)
 
-    if not (types or seminaires or debut or fin):
-        return jsonify([])
 
+def apply_demande_filters_avances(query, types, seminaires, debut, fin, model=Demande):
+    """Applique les filtres avancés (listes de types/séminaires et période)."""
     if types:
-        query = query.filter(Demande.type.in_(types))
+        query = query.filter(model.type.in_(types))
     if seminaires:
-        query = query.filter(Demande.reference.in_(seminaires))
+        query = query.filter(model.reference.in_(seminaires))
 
     # Application des filtres sur les dates
     if debut and not fin:
         try:
             debut_date = datetime.strptime(debut, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_debut == debut_date)
+            query = query.filter(model.date_debut == debut_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'debut': {debut}", file=sys.stderr)
     elif fin and not debut:
         try:
             fin_date = datetime.strptime(fin, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_fin == fin_date)
+            query = query.filter(model.date_fin == fin_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'fin': {fin}", file=sys.stderr)
     elif debut and fin:
         try:
             debut_date = datetime.strptime(debut, "%Y-%m-%d").date()
             fin_date = datetime.strptime(fin, "%Y-%m-%d").date()
-            query = query.filter(Demande.date_debut >= debut_date,
-                                 Demande.date_fin <= fin_date)
+            query = query.filter(model.date_debut >= debut_date,
+                                 model.date_fin <= fin_date)
         except ValueError:
             print(f"[DEBUG] Erreur de conversion pour 'debut' ou 'fin': {debut} / {fin}", file=sys.stderr)
 
+    return query
+
+
+@app.route('/filtrer-demandes-avances')
+@login_required
+def filtrer_demandes_avances():
+    types = request.args.getlist('types')
+    seminaires = request.args.getlist('seminaires')
+    debut = request.args.get('debut')
+    fin = request.args.get('fin')
+
+    print(f"[DEBUG] Types: {types}", file=sys.stderr)
+    print(f"[DEBUG] Séminaires: {seminaires}", file=sys.stderr)
+    print(f"[DEBUG] Dates: {debut} → {fin}", file=sys.stderr)
+
+    if not (types or seminaires or debut or fin):
+        return jsonify([])
+
+    query = apply_demande_filters_avances(Demande.query, types, seminaires, debut, fin)
     demandes = query.all()
+    if reaches_archive(debut, fin):
+        demandes += apply_demande_filters_avances(DemandeArchive.query, types, seminaires,
+                                                  debut, fin, DemandeArchive).all()
 
-    result = [{
-        "id": d.id,
-        "type": d.type,
-        "reference": d.reference,
-        "theme": d.theme,
-        "nom": d.nom,
-        "prenoms": d.prenoms,
-        "tels": d.tels,
-        "emails": d.emails,
-        "organisme": d.organisme,
-        "pays": d.pays,
-        "contact": d.contact,
-        "lieu": d.lieu_formation,
-        "debut": d.date_debut.strftime('%Y-%m-%d') if d.date_debut else '',
-        "fin": d.date_fin.strftime('%Y-%m-%d') if d.date_fin else '',
-        "duree": d.duree,
-        "dateRecep": d.date_recep_mail.strftime('%Y-%m-%d') if d.date_recep_mail else "",
-        "dateAccuseRecep": d.date_accuse_recep.strftime('%Y-%m-%d') if d.date_accuse_recep else "",
-        "proforma": d.proforma,
-        "fiche": d.fiche_inscription,
-        "attestation": d.attestation
-    } for d in demandes]
+    result = [demande_to_dict(d) for d in demandes]
 
     return jsonify(result)
 
 
 
 
+@app.route('/changes')
+@login_required
+def changes():
+    """Flux des changements postérieurs au curseur `since`.
+
+    Sans `since`, renvoie seulement le curseur courant (point de départ du client).
+    """
+    head = current_cursor()
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"cursor": head, "changes": [], "has_more": False})
+
+    limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+    query = Changement.query.filter(Changement.seq > since, Changement.seq <= head)
+    tables = request.args.getlist('tables')
+    if tables:
+        query = query.filter(Changement.table_name.in_(tables))
+
+    rows = query.order_by(Changement.seq).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        "cursor": rows[-1].seq if has_more else head,
+        "has_more": has_more,
+        "changes": [{
+            "seq": c.seq,
+            "table": c.table_name,
+            "id": c.row_id,
+            "op": c.operation,
+            "data": json.loads(c.payload) if c.payload else None,
+        } for c in rows],
+    })
+
+
+@app.route('/typeahead/<kind>')
+@login_required
+def typeahead(kind):
+    """Autocomplétion par préfixe (sans accents) ; `scope` restreint au pays ou au type."""
+    if kind not in TYPEAHEAD_SOURCES:
+        abort(404)
+    refresh_typeahead()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    with typeahead_lock:
+        results = typeahead_indexes[kind].search(request.args.get('q', ''), limit,
+                                                 request.args.get('scope') or None)
+    return jsonify(results)
+
+
 # --------- Types CRUD Routes ---------
 @app.route('/types_de_formation', methods=['GET'])
 @login_required
@@ -597,6 +942,22 @@ def delete_seminaire(id):
 
 
 # --------- Demandes CRUD ---------
+def organisme_exists(name, pays):
+    return db.session.query(
+        Organisme.query.filter_by(name=name, country=pays).exists()
+    ).scalar()
+
+
+def demande_response(message, category):
+    """Réponse des formulaires de demandes : JSON (message + curseur du flux) quand ils sont
+    envoyés en fetch, sinon flash et rechargement de la page."""
+    if request.accept_mimetypes.best == 'application/json':
+        status = 400 if category == 'danger' else 200
+        return jsonify({'message': message, 'category': category, 'cursor': current_cursor()}), status
+    flash(message, category)
+    return redirect(url_for('demandes'))
+
+
 @app.route('/demandes/create', methods=['POST'])
 @login_required
 def create_demande():
@@ -609,8 +970,11 @@ def create_demande():
         
         # Ensure all required fields are received
         if not all([date_debut, date_fin, date_recep_mail, date_accuse_recep]):
-            flash("Toutes les dates doivent être fournies!", "danger")
-            return redirect(url_for('demandes'))
+            return demande_response("Toutes les dates doivent être fournies!", "danger")
+
+        # The organisme is typed with suggestions: it must exist for the chosen country
+        if not organisme_exists(request.form.get('organisme', '').strip(), request.form.get('pays', '').strip()):
+            return demande_response("Organisme inconnu pour ce pays!", "danger")
 
         # Create new Demande object
         demande = Demande(
@@ -636,17 +1000,17 @@ def create_demande():
             attestation=request.form.get('attestation', '').strip()
         )
 
-        # Add and commit to the database
+        # Add and commit to the database, with the acknowledgement mails queued
         db.session.add(demande)
+        db.session.flush()
+        enqueue_mails('accuse', [demande])
         db.session.commit()
-        flash("Demande ajoutée avec succès!", "success")
+        return demande_response("Demande ajoutée avec succès!", "success")
 
     except Exception as e:
         db.session.rollback()
         print(f"Erreur lors de l'ajout de la demande: {e}")
-        flash("Une erreur s'est produite lors de l'ajout de la demande.", "danger")
-
-    return redirect(url_for('demandes'))
+        return demande_response("Une erreur s'est produite lors de l'ajout de la demande.", "danger")
 
 
 @app.route('/demandes/<int:id>/edit', methods=['POST'])
@@ -660,6 +1024,13 @@ def edit_demande(id):
         date_recep_mail = datetime.strptime(request.form.get('recep', '').strip(), "%Y-%m-%d").date()
         date_accuse_recep = datetime.strptime(request.form.get('accuseRecep', '').strip(), "%Y-%m-%d").date()
 
+        # The organisme must exist for the chosen country, unless left unchanged
+        organisme = request.form.get('organisme', '').strip()
+        pays = request.form.get('pays', '').strip()
+        unchanged = (organisme, pays) == (demande.organisme, demande.pays)
+        if not unchanged and not organisme_exists(organisme, pays):
+            return demande_response("Organisme inconnu pour ce pays!", "danger")
+
         # Update Demande object
         demande.type = request.form.get('type', '').strip()
         demande.reference = request.form.get('reference', '').strip()
@@ -684,14 +1055,12 @@ def edit_demande(id):
 
         # Commit changes to the database
         db.session.commit()
-        flash("Demande mise à jour avec succès!", "success")
+        return demande_response("Demande mise à jour avec succès!", "success")
 
     except Exception as e:
         db.session.rollback()
         print(f"Erreur lors de la mise à jour de la demande: {e}")
-        flash("Une erreur s'est produite lors de la mise à jour de la demande.", "danger")
-
-    return redirect(url_for('demandes'))
+        return demande_response("Une erreur s'est produite lors de la mise à jour de la demande.", "danger")
 
 
 @app.route('/demandes/<int:id>/delete', methods=['POST'])
@@ -700,8 +1069,347 @@ def delete_demande(id):
     demande = Demande.query.get_or_404(id)
     db.session.delete(demande)
     db.session.commit()
-    flash(f'Demande #{id} supprimée!', 'info')
-    return redirect(url_for('demandes'))
+    return demande_response(f'Demande #{id} supprimée!', 'info')
+
+
+# --------- Documents ---------
+@app.route('/demandes/<int:id>/documents/<kind>', methods=['POST'])
+@login_required
+def generate_document(id, kind):
+    if kind not in DOCUMENT_KINDS:
+        abort(404)
+    demande = Demande.query.get_or_404(id)
+    context = document_contexts([demande])[0]
+    html = render_document(kind, context)
+    try:
+        bulk_set_status(Demande.query.filter(Demande.id == id), kind, 'envoyée')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la mise à jour du statut {kind}: {e}")
+        flash("Une erreur s'est produite lors de la génération du document.", "danger")
+        return redirect(url_for('demandes'))
+
+    return Response(html, mimetype='text/html', headers={
+        'Content-Disposition': f'inline; filename="{document_filename(kind, context)}"'
+    })
+
+
+@app.route('/seminaires/<int:id>/documents/<kind>', methods=['POST'])
+@login_required
+def generate_seminaire_documents(id, kind):
+    if kind not in DOCUMENT_KINDS:
+        abort(404)
+    sem = Seminaire.query.get_or_404(id)
+    demandes = (Demande.query.filter_by(reference=sem.reference)
+                .order_by(Demande.nom, Demande.prenoms).all())
+    if not demandes:
+        flash('Aucune demande pour ce séminaire.', 'warning')
+        return redirect(url_for('seminaires'))
+
+    bundle = build_zip(render_documents(kind, document_contexts(demandes)))
+    try:
+        # Only the demandes actually in the bundle, not ones added while rendering
+        rendered = Demande.query.filter(Demande.id.in_([d.id for d in demandes]))
+        bulk_set_status(rendered, kind, 'envoyée')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la mise à jour des statuts {kind}: {e}")
+        flash("Une erreur s'est produite lors de la génération des documents.", "danger")
+        return redirect(url_for('seminaires'))
+
+    return send_file(bundle, mimetype='application/zip', as_attachment=True,
+                     download_name=f'{kind}s-{slugify(sem.reference)}.zip')
+
+
+# --------- Mise à jour groupée ---------
+def log_demandes_updated(ids):
+    """Journalise l'état relu des demandes `ids` après un UPDATE ensembliste."""
+    rows = []
+    for start in range(0, len(ids), 500):
+        chunk = (Demande.query.filter(Demande.id.in_(ids[start:start + 500]))
+                 .execution_options(populate_existing=True))
+        rows.extend(demande_to_dict(d) for d in chunk)
+    log_changes('update', 'demandes', rows)
+
+
+def bulk_set_status(query, field, value):
+    """Passe `field` à `value` sur les demandes de `query` par UPDATE ensemblistes.
+
+    Le filtre n'est évalué qu'une fois : l'UPDATE porte sur les ids relus, pas sur `query`, pour
+    qu'une ligne insérée entre-temps ne soit pas modifiée sans être journalisée.
+    Le journal des changements est alimenté une fois pour tout le lot.
+    Retourne le nombre de lignes modifiées ; le commit reste à la charge de l'appelant.
+    """
+    column = getattr(Demande, STATUS_FIELDS[field][0])
+    ids = [i for (i,) in query.filter(~status_in(field, value)).with_entities(Demande.id)]
+    if not ids:
+        return 0
+
+    updated = 0
+    for start in range(0, len(ids), 500):
+        updated += (Demande.query.filter(Demande.id.in_(ids[start:start + 500]))
+                    .update({column: value}, synchronize_session=False))
+    log_demandes_updated(ids)
+    return updated
+
+
+@app.route('/demandes/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_demandes():
+    data = request.get_json(silent=True) or {}
+    field = data.get('field')
+    value = data.get('value')
+    if field not in STATUS_FIELDS or value not in STATUS_FIELDS[field][1]:
+        return jsonify({'error': 'Champ ou valeur invalide'}), 400
+
+    if data.get('ids'):
+        if not isinstance(data['ids'], list):
+            return jsonify({'error': 'Identifiants invalides'}), 400
+        try:
+            ids = [int(i) for i in data['ids']]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Identifiants invalides'}), 400
+        query = Demande.query.filter(Demande.id.in_(ids))
+    elif data.get('filters'):
+        filters = data['filters']
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'Filtres invalides'}), 400
+        # Écriture en masse : seuls les filtres effectifs comptent, et les dates doivent être valides
+        effective = {k: v for k, v in filters.items()
+                     if k in BULK_FILTER_KEYS and v and v != 'all'}
+        if not all(isinstance(v, str) for v in effective.values()):
+            return jsonify({'error': 'Filtres invalides'}), 400
+        if not effective:
+            return jsonify({'error': 'Au moins un filtre est requis'}), 400
+        for key in ('debut', 'fin'):
+            if key in effective:
+                try:
+                    datetime.strptime(effective[key], "%Y-%m-%d")
+                except ValueError:
+                    return jsonify({'error': f"Date invalide pour '{key}'"}), 400
+        query = apply_demande_filters(Demande.query, effective)
+    else:
+        return jsonify({'error': 'Aucune demande sélectionnée'}), 400
+
+    try:
+        updated = bulk_set_status(query, field, value)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur lors de la mise à jour groupée: {e}")
+        return jsonify({'error': "Une erreur s'est produite lors de la mise à jour groupée."}), 500
+
+    return jsonify({'updated': updated, 'cursor': current_cursor()})
+
+
+# --------- Archivage ---------
+def reaches_archive(debut, fin):
+    """Vrai si la période demandée commence avant la fin de la dernière session archivée.
+
+    Sans date, seules les demandes courantes sont interrogées.
+    """
+    start = debut or fin
+    if not start:
+        return False
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date()
+    except ValueError:
+        return False
+    horizon = db.session.query(func.max(DemandeArchive.date_fin)).scalar()
+    return horizon is not None and start_date <= horizon
+
+
+def archive_demandes(retention_days, batch_size=500, dry_run=False):
+    """Déplace vers `demandes_archive` les demandes clôturées depuis plus de `retention_days` jours.
+
+    Une demande est clôturée quand sa session est terminée et son attestation envoyée.
+    Chaque lot est copié puis supprimé dans sa propre transaction. Retourne le nombre archivé.
+    """
+    cutoff = date.today() - timedelta(days=retention_days)
+    closed = Demande.query.filter(Demande.date_fin < cutoff,
+                                  status_in('attestation', 'envoyée'))
+    if dry_run:
+        return closed.count()
+
+    columns = [c.name for c in Demande.__table__.columns if c.name in DemandeArchive.__table__.columns]
+    total = 0
+    while True:
+        ids = [i for (i,) in closed.with_entities(Demande.id).order_by(Demande.id).limit(batch_size)]
+        if not ids:
+            break
+        try:
+            db.session.execute(
+                DemandeArchive.__table__.insert().from_select(
+                    columns + ['archived_at'],
+                    db.select(*[Demande.__table__.c[name] for name in columns],
+                              literal(datetime.now()))
+                    .where(Demande.id.in_(ids))
+                )
+            )
+            db.session.execute(Demande.__table__.delete().where(Demande.id.in_(ids)))
+            log_changes('archive', 'demandes', [{"id": i} for i in ids])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(ids)
+    return total
+
+
+@app.cli.command('archive')
+@click.option('--retention-days', type=int, default=None,
+              help="Jours après la fin de session (défaut : ARCHIVE_RETENTION_DAYS).")
+@click.option('--batch-size', type=int, default=500, show_default=True)
+@click.option('--dry-run', is_flag=True, help="Compte les demandes sans les déplacer.")
+def archive_command(retention_days, batch_size, dry_run):
+    """Archive les demandes des sessions clôturées."""
+    if retention_days is None:
+        retention_days = app.config['ARCHIVE_RETENTION_DAYS']
+    count = archive_demandes(retention_days, batch_size, dry_run)
+    if dry_run:
+        click.echo(f"{count} demande(s) à archiver.")
+    else:
+        click.echo(f"{count} demande(s) archivée(s).")
+
+
+# --------- Courriels ---------
+MAIL_SUBJECTS = {
+    'accuse': "Accusé de réception de votre demande d'inscription",
+    'relance': "Rappel : fiche d'inscription attendue",
+}
+# Un lot réservé ('sending') dont l'envoi a été interrompu redevient disponible après ce délai
+MAIL_CLAIM_LEASE = timedelta(hours=1)
+
+
+def split_emails(emails):
+    return [e for e in re.split(r'[\s,;]+', emails or '') if '@' in e]
+
+
+def enqueue_mails(kind, demandes):
+    """Met en file un courriel `kind` par adresse des demandes ; l'envoi est fait par `flask send-mails`."""
+    count = 0
+    for demande in demandes:
+        body = render_template(f'mails/{kind}.txt', demande=demande)
+        for recipient in split_emails(demande.emails):
+            db.session.add(Courriel(demande_id=demande.id, kind=kind, recipient=recipient,
+                                    subject=MAIL_SUBJECTS[kind], body=body))
+            count += 1
+    return count
+
+
+def enqueue_relances(min_interval_days=7):
+    """Relance les participants des sessions à venir dont la fiche d'inscription n'est pas reçue."""
+    recent = (db.select(Courriel.demande_id)
+              .where(Courriel.kind == 'relance',
+                     Courriel.created_at >= datetime.now() - timedelta(days=min_interval_days)))
+    demandes = (Demande.query
+                .filter(status_in('fiche', 'non reçue'),
+                        Demande.date_debut >= date.today(),
+                        Demande.id.not_in(recent))
+                .all())
+    return enqueue_mails('relance', demandes)
+
+
+def build_message(mail):
+    message = EmailMessage()
+    message['From'] = app.config['MAIL_SENDER']
+    message['To'] = mail.recipient
+    message['Subject'] = mail.subject
+    message.set_content(mail.body)
+    return message
+
+
+def claim_mails(limit):
+    """Réserve jusqu'à `limit` courriels dus en les passant à 'sending'.
+
+    Chaque ligne est réservée par un UPDATE conditionnel : deux `flask send-mails` simultanés
+    (cron et --watch) ne se partagent jamais un courriel. Une réservation expirée est reprise.
+    """
+    now = datetime.now()
+    due = (Courriel.status.in_(('pending', 'sending')), Courriel.next_attempt_at <= now)
+    candidates = [i for (i,) in (db.session.query(Courriel.id).filter(*due)
+                                 .order_by(Courriel.id).limit(limit))]
+    claimed = [i for i in candidates
+               if Courriel.query.filter(Courriel.id == i, *due).update(
+                   {Courriel.status: 'sending', Courriel.next_attempt_at: now + MAIL_CLAIM_LEASE},
+                   synchronize_session=False)]
+    db.session.commit()
+    if not claimed:
+        return []
+    return Courriel.query.filter(Courriel.id.in_(claimed)).order_by(Courriel.id).all()
+
+
+def record_deliveries(mails, errors):
+    """Enregistre le résultat d'un lot ; les accusés envoyés datent `date_accuse_recep` en un seul UPDATE."""
+    now = datetime.now()
+    acknowledged = set()
+    for mail in mails:
+        error = errors[mail.id]
+        mail.attempts += 1
+        if error is None:
+            mail.status = 'sent'
+            mail.sent_at = now
+            mail.last_error = None
+            if mail.kind == 'accuse':
+                acknowledged.add(mail.demande_id)
+        else:
+            mail.last_error = (str(error) or type(error).__name__)[:500]
+            if is_permanent(error) or mail.attempts >= app.config['MAIL_MAX_ATTEMPTS']:
+                mail.status = 'failed'
+            else:
+                mail.status = 'pending'
+                mail.next_attempt_at = now + timedelta(minutes=2 ** mail.attempts)
+
+    if acknowledged:
+        ids = sorted(acknowledged)
+        Demande.query.filter(Demande.id.in_(ids)).update(
+            {Demande.date_accuse_recep: now.date()}, synchronize_session=False)
+        log_demandes_updated(ids)
+    db.session.commit()
+
+
+async def run_outbox(watch=False, interval=30):
+    """Vide la file par lots sur une même réserve de connexions SMTP ; `watch` continue à l'écoute."""
+    mailer = Mailer(app.config['MAIL_SERVER'], app.config['MAIL_PORT'],
+                    pool_size=app.config['MAIL_POOL_SIZE'], rate=app.config['MAIL_RATE'],
+                    username=app.config['MAIL_USERNAME'], password=app.config['MAIL_PASSWORD'],
+                    use_tls=app.config['MAIL_USE_TLS'], timeout=app.config['MAIL_TIMEOUT'])
+    total = 0
+    try:
+        while True:
+            mails = claim_mails(app.config['MAIL_BATCH_SIZE'])
+            if mails:
+                errors = await mailer.deliver([(mail.id, build_message(mail)) for mail in mails])
+                record_deliveries(mails, errors)
+                total += sum(1 for error in errors.values() if error is None)
+            elif watch:
+                await asyncio.sleep(interval)
+            else:
+                break
+    finally:
+        await mailer.close()
+    return total
+
+
+@app.cli.command('send-mails')
+@click.option('--watch', is_flag=True, help="Reste actif et envoie les nouveaux courriels au fil de l'eau.")
+@click.option('--interval', type=int, default=30, show_default=True, help="Secondes entre deux lectures de la file.")
+def send_mails_command(watch, interval):
+    """Envoie les courriels en attente."""
+    sent = asyncio.run(run_outbox(watch, interval))
+    click.echo(f"{sent} courriel(s) envoyé(s).")
+
+
+@app.cli.command('enqueue-reminders')
+@click.option('--min-interval-days', type=int, default=7, show_default=True,
+              help="Délai minimal entre deux relances d'une même demande.")
+def enqueue_reminders_command(min_interval_days):
+    """Met en file les relances des fiches d'inscription non reçues."""
+    count = enqueue_relances(min_interval_days)
+    db.session.commit()
+    click.echo(f"{count} relance(s) en attente d'envoi.")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,68 @@
+# documents.py
+# Génération des attestations et proformas (HTML imprimable) à partir de templates/documents.
+# Module sans dépendance à Flask : il est importé par les processus du pool de rendu.
+import io
+import os
+import re
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'documents')
+DOCUMENT_KINDS = ('attestation', 'proforma')
+
+# En dessous de ce nombre de documents, le démarrage du pool coûte plus que le rendu
+POOL_THRESHOLD = 50
+
+_env = None
+
+
+def get_env():
+    global _env
+    if _env is None:
+        _env = Environment(loader=FileSystemLoader(TEMPLATES_DIR),
+                           autoescape=select_autoescape(['html']))
+    return _env
+
+
+def slugify(value):
+    value = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^A-Za-z0-9]+', '-', value).strip('-').lower()
+
+
+def document_filename(kind, context):
+    return f"{kind}-{context['id']}-{slugify(context['nom'] + ' ' + context['prenoms'])}.html"
+
+
+def render_document(kind, context):
+    return get_env().get_template(f'{kind}.html').render(**context)
+
+
+def _render_job(job):
+    kind, context = job
+    return document_filename(kind, context), render_document(kind, context)
+
+
+def render_documents(kind, contexts, max_workers=None):
+    """Rend un document par contexte ; retourne une liste de (nom de fichier, html).
+
+    Les gros lots sont répartis sur un pool de processus.
+    """
+    jobs = [(kind, context) for context in contexts]
+    if len(jobs) < POOL_THRESHOLD:
+        return [_render_job(job) for job in jobs]
+
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_job, jobs, chunksize=chunksize))
+
+
+def build_zip(documents):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, html in documents:
+            archive.writestr(filename, html)
+    buffer.seek(0)
+    return buffer
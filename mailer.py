@@ -0,0 +1,131 @@
+# mailer.py
+# Envoi asynchrone des courriels de la file d'attente : connexions SMTP réutilisées, débit limité.
+# smtplib étant bloquant, chaque échange SMTP s'exécute dans un thread via asyncio.to_thread.
+import asyncio
+import smtplib
+import time
+
+# Refus portant sur un message : la connexion reste utilisable pour les suivants
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def is_permanent(error):
+    """Vrai pour un refus 5xx du serveur : inutile de renvoyer. Les 4xx et erreurs de connexion sont temporaires."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+    elif isinstance(error, MESSAGE_ERRORS):
+        codes = [error.smtp_code]
+    else:
+        return False
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+class RateLimiter:
+    """Espace les envois pour ne pas dépasser `rate` messages par seconde (0 = illimité)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SMTPPool:
+    """Au plus `size` connexions SMTP ouvertes à la demande puis réutilisées d'un message à l'autre."""
+
+    def __init__(self, host, port, size=2, username=None, password=None, use_tls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(size)  # une place par connexion, libérée même si elle est fermée
+        self._idle = []
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            return await asyncio.to_thread(self._connect)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, smtp):
+        self._idle.append(smtp)
+        self._slots.release()
+
+    async def _discard(self, smtp):
+        self._slots.release()
+        try:
+            await asyncio.to_thread(smtp.close)
+        except OSError:
+            pass
+
+    async def send(self, message):
+        smtp = await self._acquire()
+        try:
+            await asyncio.to_thread(smtp.send_message, message)
+        except MESSAGE_ERRORS:
+            self._release(smtp)
+            raise
+        except BaseException:
+            await self._discard(smtp)
+            raise
+        self._release(smtp)
+
+    async def close(self):
+        while self._idle:
+            smtp = self._idle.pop()
+            try:
+                await asyncio.to_thread(smtp.quit)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+class Mailer:
+    def __init__(self, host, port, pool_size=2, rate=5, retries=1, **smtp_options):
+        self.pool = SMTPPool(host, port, size=pool_size, **smtp_options)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+
+    async def _send_one(self, message):
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait()
+            try:
+                await self.pool.send(message)
+                return None
+            except MESSAGE_ERRORS as e:
+                return e
+            except (smtplib.SMTPException, OSError) as e:
+                # Connexion perdue ou refusée : nouvel essai sur une connexion neuve
+                error = e
+        return error
+
+    async def deliver(self, messages):
+        """Envoie un lot de (id, EmailMessage) ; retourne {id: None si envoyé, sinon l'exception}."""
+        errors = await asyncio.gather(*(self._send_one(message) for _, message in messages))
+        return {mail_id: error for (mail_id, _), error in zip(messages, errors)}
+
+    async def close(self):
+        await self.pool.close()
@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+# L'application se lie à sa base à l'import : base temporaire avant tout import de app
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmpdir, 'test.sqlite3')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    """Le schéma n'est plus créé à l'import (cf. `flask upgrade-db`)."""
+    from app import app, db
+    with app.app_context():
+        db.create_all()
@@ -0,0 +1,43 @@
+# tests/test_archive.py
+# Archivage des demandes clôturées (flask archive).
+from datetime import date
+
+import pytest
+
+from app import app, db, Demande, DemandeArchive, Changement, archive_demandes
+
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        yield
+        db.session.rollback()
+        Changement.query.delete()
+        DemandeArchive.query.delete()
+        Demande.query.delete()
+        db.session.commit()
+
+
+def add_demande(reference, attestation, date_fin=date(2000, 1, 5)):
+    demande = Demande(type='T', reference=reference, theme='Thème', civilite='m.', nom='Nom', prenoms='P',
+                      pays='Bénin', organisme='O', lieu_formation='Cotonou', date_debut=date(2000, 1, 1),
+                      date_fin=date_fin, duree='5 jours', date_recep_mail=date(2000, 1, 1),
+                      date_accuse_recep=date(2000, 1, 1), proforma='envoyée', fiche_inscription='reçue',
+                      attestation=attestation)
+    db.session.add(demande)
+    return demande
+
+
+def test_closed_demandes_are_archived_whatever_the_spelling(ctx):
+    for reference, attestation in (('R1', 'envoyée'), ('R2', 'envoyé'), ('R3', 'sent'),
+                                   ('R4', 'non envoyé'), ('R5', 'not-sent')):
+        add_demande(reference, attestation)
+    add_demande('R6', 'envoyée', date_fin=date.today())
+    db.session.commit()
+
+    assert archive_demandes(retention_days=30, dry_run=True) == 3
+    assert archive_demandes(retention_days=30, batch_size=2) == 3
+
+    assert sorted(a.reference for a in DemandeArchive.query) == ['R1', 'R2', 'R3']
+    assert sorted(d.reference for d in Demande.query) == ['R4', 'R5', 'R6']
+    assert Changement.query.filter_by(operation='archive').count() == 3
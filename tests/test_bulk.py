@@ -0,0 +1,64 @@
+# tests/test_bulk.py
+# Mise à jour groupée des statuts : ce qui est modifié est exactement ce qui est journalisé.
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import event, text
+
+from app import app, db, Demande, Changement, bulk_set_status
+
+ROW = dict(type='T', theme='Thème', civilite='m.', prenoms='P', pays='Bénin', organisme='O',
+           lieu_formation='Cotonou', date_debut=date(2030, 1, 1), date_fin=date(2030, 1, 5),
+           duree='5 jours', date_recep_mail=date(2020, 1, 1), date_accuse_recep=date(2020, 1, 1),
+           proforma='non envoyée', fiche_inscription='non reçue', attestation='non envoyée')
+
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        yield
+        db.session.rollback()
+        Changement.query.delete()
+        Demande.query.delete()
+        db.session.commit()
+
+
+def test_row_inserted_during_update_is_left_alone(ctx):
+    db.session.add(Demande(reference='R1', nom='Nom1', **ROW))
+    db.session.commit()
+    start = db.session.query(db.func.coalesce(db.func.max(Changement.seq), 0)).scalar()
+
+    # Une autre requête valide une demande correspondante entre la lecture des ids et l'UPDATE
+    inserted = []
+
+    def insert_concurrently(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE demandes') and not inserted:
+            inserted.append(True)
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as other:
+                other.execute(Demande.__table__.insert(), dict(ROW, reference='R2', nom='Nom2'))
+
+    event.listen(db.engine, 'before_cursor_execute', insert_concurrently)
+    try:
+        updated = bulk_set_status(Demande.query.filter(Demande.type == 'T'), 'proforma', 'envoyée')
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', insert_concurrently)
+
+    logged = [json.loads(c.payload)['nom'] for c in Changement.query.filter(Changement.seq > start)]
+    statuses = dict(db.session.execute(text("SELECT nom, proforma FROM demandes")).all())
+    assert updated == 1
+    assert logged == ['Nom1']
+    assert statuses == {'Nom1': 'envoyée', 'Nom2': 'non envoyée'}
+
+
+def test_rows_already_set_under_another_spelling_are_left_alone(ctx):
+    for i, proforma in enumerate(('sent', 'envoyé', 'non envoyé')):
+        db.session.add(Demande(reference=f'R{i}', nom=f'Nom{i}', **dict(ROW, proforma=proforma)))
+    db.session.commit()
+
+    updated = bulk_set_status(Demande.query, 'proforma', 'envoyée')
+    db.session.commit()
+
+    assert updated == 1
+    assert sorted(d.proforma for d in Demande.query) == ['envoyé', 'envoyée', 'sent']
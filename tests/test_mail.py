@@ -0,0 +1,159 @@
+# tests/test_mail.py
+# Envoi de la file des courriels de bout en bout contre un serveur SMTP local (aiosmtpd).
+import asyncio
+import socket
+import threading
+from datetime import date, datetime
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import app, db, Demande, Courriel, enqueue_mails, enqueue_relances, run_outbox
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('refuse'):
+            return '550 mailbox unavailable'
+        if address.startswith('busy'):
+            return '450 mailbox busy'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.rcpt_tos)
+        self.sessions.add(id(session))
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=controller.port,
+                      MAIL_POOL_SIZE=2, MAIL_RATE=0, MAIL_TIMEOUT=5)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        yield
+        db.session.rollback()
+        Courriel.query.delete()
+        Demande.query.delete()
+        db.session.commit()
+
+
+def make_demandes(count, emails='{i}@example.org', fiche='non reçue', first=0):
+    demandes = []
+    for i in range(first, first + count):
+        demande = Demande(
+            type='T', reference=f'R{i}', theme='Thème', civilite='m.', nom=f'Nom{i}', prenoms='P',
+            emails=emails.format(i=i), pays='Bénin', organisme='O', lieu_formation='Cotonou',
+            date_debut=date(2030, 1, 1), date_fin=date(2030, 1, 5), duree='5 jours',
+            date_recep_mail=date(2020, 1, 1), date_accuse_recep=date(2020, 1, 1),
+            proforma='non envoyée', fiche_inscription=fiche, attestation='non envoyée',
+        )
+        db.session.add(demande)
+        demandes.append(demande)
+    db.session.flush()
+    enqueue_mails('accuse', demandes)
+    db.session.commit()
+    return demandes
+
+
+def test_outbox_delivered_over_reused_connections(smtp_server, ctx):
+    make_demandes(30)
+
+    sent = asyncio.run(run_outbox())
+
+    assert sent == 30
+    assert len(smtp_server.messages) == 30
+    assert len(smtp_server.sessions) <= app.config['MAIL_POOL_SIZE']
+    assert Courriel.query.filter(Courriel.status != 'sent').count() == 0
+    assert {d.date_accuse_recep for d in Demande.query} == {date.today()}
+
+
+def test_overlapping_runs_deliver_each_mail_once(smtp_server, ctx):
+    make_demandes(30)
+    sent = []
+
+    def run():
+        with app.app_context():
+            sent.append(asyncio.run(run_outbox()))
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(sent) == 30
+    assert sorted(smtp_server.messages) == sorted([f'{i}@example.org'] for i in range(30))
+
+
+def test_permanent_refusal_fails_at_once(smtp_server, ctx):
+    demande, = make_demandes(1, emails='refuse@example.org')
+
+    sent = asyncio.run(run_outbox())
+
+    mail = Courriel.query.one()
+    assert sent == 0
+    assert mail.status == 'failed'
+    assert mail.attempts == 1
+    assert '550' in mail.last_error
+    assert db.session.get(Demande, demande.id).date_accuse_recep == date(2020, 1, 1)
+
+
+def test_temporary_refusal_is_retried_later(smtp_server, ctx):
+    make_demandes(1, emails='busy@example.org')
+
+    sent = asyncio.run(run_outbox())
+
+    mail = Courriel.query.one()
+    assert sent == 0
+    assert mail.status == 'pending'
+    assert mail.attempts == 1
+    assert '450' in mail.last_error
+    assert mail.next_attempt_at > datetime.now()
+
+
+def test_stalled_server_does_not_hang(ctx):
+    # Serveur qui accepte les connexions sans jamais envoyer de bannière
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    accepted = []
+    threading.Thread(target=lambda: [accepted.append(server.accept()) for _ in iter(int, 1)],
+                     daemon=True).start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.getsockname()[1],
+                      MAIL_POOL_SIZE=2, MAIL_RATE=0, MAIL_TIMEOUT=1)
+    make_demandes(5)
+
+    sent = asyncio.run(asyncio.wait_for(run_outbox(), timeout=30))
+
+    assert sent == 0
+    assert Courriel.query.filter_by(status='pending', attempts=1).count() == 5
+    server.close()
+
+
+def test_reminders_follow_every_spelling_of_not_received(ctx):
+    pending = make_demandes(1, fiche='not-received') + make_demandes(1, fiche='non reçue', first=1)
+    make_demandes(1, fiche='received', first=2)
+
+    assert enqueue_relances() == 2
+    db.session.commit()
+    assert {m.demande_id for m in Courriel.query.filter_by(kind='relance')} == {d.id for d in pending}
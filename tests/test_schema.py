@@ -0,0 +1,80 @@
+# tests/test_schema.py
+# Migration de la table `demandes` vers AUTOINCREMENT (flask upgrade-db).
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+from app import app, db, Demande, DemandeArchive, migrate_demandes_autoincrement
+
+ROW = ("INSERT INTO demandes (id, type, reference, theme, civilite, nom, prenoms, pays, organisme,"
+       " lieu_formation, date_debut, date_fin, duree, date_recep_mail, date_accuse_recep,"
+       " proforma, fiche_inscription, attestation)"
+       " VALUES (:id, 'T', :ref, 'Thème', 'm.', :nom, 'P', 'Bénin', 'O', 'Cotonou', '2020-01-01',"
+       " '2020-01-05', '5 jours', '2020-01-01', '2020-01-01', 'non envoyée', 'non reçue', 'non envoyée')")
+
+
+def table_sql(conn):
+    return conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'demandes'")).scalar()
+
+
+@pytest.fixture
+def legacy_table():
+    """Remplace `demandes` par sa version d'avant l'archivage : sans AUTOINCREMENT, `nom` nullable."""
+    with app.app_context():
+        ddl = str(CreateTable(Demande.__table__).compile(db.engine))
+        ddl = ddl.replace('AUTOINCREMENT', '').replace('nom VARCHAR(100) NOT NULL', 'nom VARCHAR(100)')
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE demandes"))
+            conn.execute(text(ddl))
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'demandes'"))
+            for i in (1, 2, 3):
+                conn.execute(text(ROW), {"id": i, "ref": f"R{i}", "nom": f"Nom{i}"})
+        yield
+        db.session.rollback()
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS demandes_old"))
+            conn.execute(text("DROP TABLE demandes"))
+            conn.execute(text("DELETE FROM demandes_archive"))
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'demandes'"))
+        Demande.__table__.create(db.engine)
+
+
+def test_migration_keeps_rows_and_skips_archived_ids(legacy_table):
+    archived = dict(type='T', reference='R7', theme='Thème', civilite='m.', nom='Nom7', prenoms='P',
+                    pays='Bénin', organisme='O', lieu_formation='Cotonou', date_debut=date(2019, 1, 1),
+                    date_fin=date(2019, 1, 5), duree='5 jours', date_recep_mail=date(2019, 1, 1),
+                    date_accuse_recep=date(2019, 1, 1), proforma='envoyée', fiche_inscription='reçue',
+                    attestation='envoyée')
+    db.session.add(DemandeArchive(id=7, **archived))
+    db.session.commit()
+
+    assert migrate_demandes_autoincrement() is True
+    assert migrate_demandes_autoincrement() is False
+
+    with db.engine.connect() as conn:
+        assert 'AUTOINCREMENT' in table_sql(conn).upper()
+        assert conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'demandes'")).scalar() == 7
+    assert [(d.id, d.nom) for d in Demande.query.order_by(Demande.id)] == [(1, 'Nom1'), (2, 'Nom2'), (3, 'Nom3')]
+
+    archived.update(reference='R8', nom='Nom8')
+    demande = Demande(**archived)
+    db.session.add(demande)
+    db.session.commit()
+    assert demande.id == 8
+
+
+def test_failed_migration_leaves_table_untouched(legacy_table):
+    # Une ligne qui viole le nouveau schéma fait échouer la copie, après le RENAME et le CREATE
+    with db.engine.begin() as conn:
+        conn.execute(text(ROW), {"id": 4, "ref": "R4", "nom": None})
+
+    with pytest.raises(IntegrityError):
+        migrate_demandes_autoincrement()
+
+    with db.engine.connect() as conn:
+        assert 'AUTOINCREMENT' not in table_sql(conn).upper()
+        assert conn.execute(text("SELECT COUNT(*) FROM demandes")).scalar() == 4
+        assert conn.execute(text("SELECT name FROM sqlite_master WHERE name = 'demandes_old'")).scalar() is None
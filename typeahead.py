@@ -0,0 +1,95 @@
+# typeahead.py
+# Index de préfixes en mémoire (tableau trié + bisect) pour l'autocomplétion.
+import unicodedata
+from bisect import bisect_left, insort
+
+
+def fold(value):
+    """Minuscules sans accents, espaces normalisés : 'Ministère  de l'Économie' -> 'ministere de l'economie'."""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return ' '.join(value.casefold().split())
+
+
+def index_keys(texts):
+    """Clés indexées : chaque texte à partir de chacun de ses mots, pour trouver 'fin' dans 'Ministère des Finances'."""
+    keys = set()
+    for text in texts:
+        words = fold(text).split(' ')
+        for i in range(len(words)):
+            key = ' '.join(words[i:])
+            if key:
+                keys.add(key)
+    return keys
+
+
+class PrefixIndex:
+    """Deux tableaux triés : (clé, id) pour les recherches globales, (portée, clé, id) pour les
+    recherches restreintes, qui ne parcourent ainsi que les entrées de leur portée."""
+
+    def __init__(self):
+        self._keys = []    # liste triée de (clé, id)
+        self._scoped = []  # liste triée de (portée, clé, id)
+        self._items = {}   # id -> (données renvoyées, portée, clés)
+
+    def __len__(self):
+        return len(self._items)
+
+    def build(self, entries):
+        """Reconstruit l'index depuis des tuples (id, textes, données, portée)."""
+        self._items = {}
+        keys, scoped = [], []
+        for item_id, texts, data, scope in entries:
+            item_keys = index_keys(texts)
+            self._items[item_id] = (data, scope, item_keys)
+            keys.extend((key, item_id) for key in item_keys)
+            scoped.extend((scope or '', key, item_id) for key in item_keys)
+        keys.sort()
+        scoped.sort()
+        self._keys = keys
+        self._scoped = scoped
+
+    def add(self, item_id, texts, data, scope=None):
+        self.remove(item_id)
+        item_keys = index_keys(texts)
+        for key in item_keys:
+            insort(self._keys, (key, item_id))
+            insort(self._scoped, (scope or '', key, item_id))
+        self._items[item_id] = (data, scope, item_keys)
+
+    @staticmethod
+    def _delete(entries, entry):
+        i = bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def remove(self, item_id):
+        entry = self._items.pop(item_id, None)
+        if entry is None:
+            return
+        _, scope, item_keys = entry
+        for key in item_keys:
+            self._delete(self._keys, (key, item_id))
+            self._delete(self._scoped, (scope or '', key, item_id))
+
+    def search(self, prefix, limit=10, scope=None):
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        if scope:
+            entries, start, key_pos = self._scoped, (scope, prefix), 1
+        else:
+            entries, start, key_pos = self._keys, (prefix,), 0
+
+        results, seen = [], set()
+        i = bisect_left(entries, start)
+        while i < len(entries) and len(results) < limit:
+            entry = entries[i]
+            if (scope and entry[0] != scope) or not entry[key_pos].startswith(prefix):
+                break
+            i += 1
+            item_id = entry[-1]
+            if item_id not in seen:
+                seen.add(item_id)
+                results.append(self._items[item_id][0])
+        return results